@@ -52,7 +52,52 @@ def get_model_with_retry(model_name='gemini-1.5-flash', purpose='general', **gen
         # All keys failed
         raise Exception(f"All API keys failed for {purpose}. Check your keys and quotas.")
 
-def generate_with_retry(model, prompt, max_retries=MAX_RETRIES):
+# Errors generate_with_retry backs off and retries on
+RETRYABLE_ERROR_TERMS = ('rate limit', 'quota', 'too many requests')
+# Errors meaning the model's API key itself is unusable (invalid, revoked, or not permitted)
+KEY_ERROR_TERMS = ('api key', 'api_key', 'unauthenticated', 'unauthorized', 'permission denied')
+
+# Models by (model_name, purpose, temperature, top_p, top_k, max_output_tokens)
+_model_cache = {}
+
+def is_retryable_error(error):
+    """Rate-limit and quota errors, which may clear after a backoff"""
+    error_str = str(error).lower()
+    return any(term in error_str for term in RETRYABLE_ERROR_TERMS)
+
+def is_key_error(error):
+    """Authentication/permission errors that won't clear without a different API key"""
+    error_str = str(error).lower()
+    return any(term in error_str for term in KEY_ERROR_TERMS)
+
+def get_cached_model(model_name='gemini-1.5-flash', purpose='general', temperature=None,
+                     top_p=None, top_k=None, max_output_tokens=None):
+    """
+    Process-wide cache around get_model_with_retry, keyed by model name, purpose and config.
+    GenerativeModel instances hold no per-request state, so one per configuration is enough.
+    The API key is bound when the model is built, so callers should fetch the model per use
+    (not hold on to it); invalidate_cached_model drops a configuration whose key stopped working.
+    """
+    cache_key = (model_name, purpose, temperature, top_p, top_k, max_output_tokens)
+    model = _model_cache.get(cache_key)
+    if model is None:
+        generation_config = {
+            key: value for key, value in (
+                ('temperature', temperature), ('top_p', top_p),
+                ('top_k', top_k), ('max_output_tokens', max_output_tokens)
+            ) if value is not None
+        }
+        model = get_model_with_retry(model_name=model_name, purpose=purpose, **generation_config)
+        _model_cache[cache_key] = model
+    return model
+
+def invalidate_cached_model(model):
+    """Drop `model` from the cache so the next get_cached_model call for its configuration rotates keys"""
+    for cache_key, cached in list(_model_cache.items()):
+        if cached is model:
+            _model_cache.pop(cache_key, None)
+
+def generate_with_retry(model, prompt, max_retries=MAX_RETRIES, generation_config=None):
     """
     Generate content with automatic retry and exponential backoff
     
@@ -60,27 +105,26 @@ def generate_with_retry(model, prompt, max_retries=MAX_RETRIES):
         model: GenerativeModel instance
         prompt: Content to generate
         max_retries: Maximum number of retry attempts
+        generation_config: Optional per-call overrides (e.g. max_output_tokens)
         
     Returns:
         Generated text content
     """
     for attempt in range(max_retries + 1):
         try:
-            response = model.generate_content(prompt)
+            response = model.generate_content(prompt, generation_config=generation_config)
             return response.text
         except Exception as e:
-            if attempt == max_retries:
+            retryable = is_retryable_error(e)
+            if attempt == max_retries or not retryable:
+                # Rebuild with another key only if this one is rejected, or still out of quota after backoff
+                if retryable or is_key_error(e):
+                    invalidate_cached_model(model)
                 raise e
             
-            # Check if it's a rate limit error
-            error_str = str(e).lower()
-            if any(term in error_str for term in ['rate limit', 'quota', 'too many requests']):
-                wait_time = (2 ** attempt) + random.uniform(0, 1)  # Exponential backoff with jitter
-                print(f"Rate limit hit, waiting {wait_time:.1f}s before retry...")
-                time.sleep(wait_time)
-            else:
-                # Non-rate-limit error, re-raise immediately
-                raise e
+            wait_time = (2 ** attempt) + random.uniform(0, 1)  # Exponential backoff with jitter
+            print(f"Rate limit hit, waiting {wait_time:.1f}s before retry...")
+            time.sleep(wait_time)
     
     raise Exception(f"Failed to generate content after {max_retries + 1} attempts")
 
@@ -47,4 +47,17 @@ USE_SUPABASE = bool(get_supabase_url() and get_supabase_key())
 DATABASE_PATH = "study_data.db"  # Fallback for local development
 
 # Other settings
-MAX_RETRIES = 2  # Retry with different keys if one fails
\ No newline at end of file
+MAX_RETRIES = 2  # Retry with different keys if one fails
+RESPONSE_MAX_TOKENS = 120  # Socratic replies are 1-3 sentences
+QUESTION_MAX_TOKENS = 60  # Single-sentence opening questions
+
+# Chat turns are buffered per session and written in one transaction every N messages
+# (and when the study ends). Turns not yet flushed are lost if the participant closes the tab.
+MESSAGE_FLUSH_SIZE = 4
+
+# Reuse Facione scores for identical conversations (off by default to keep study scoring independent)
+FACIONE_CACHE_ENABLED = os.getenv('FACIONE_CACHE_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# Supabase admin exports: PostgREST caps each response, so tables are read in parallel pages
+EXPORT_PAGE_SIZE = 1000
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '8'))
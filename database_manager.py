@@ -2,12 +2,19 @@
 Database Manager - Handles both SQLite (local) and Supabase (cloud) storage
 """
 
+import atexit
+import concurrent.futures
+import os
+import queue
 import sqlite3
-import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, Dict, List, Any
+from typing import TYPE_CHECKING, Optional, Dict, List, Any
 import streamlit as st
-from config import USE_SUPABASE, DATABASE_PATH, get_supabase_url, get_supabase_key
+from config import USE_SUPABASE, DATABASE_PATH, EXPORT_PAGE_SIZE, EXPORT_WORKERS, get_supabase_url, get_supabase_key
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 supabase_client = None
 if USE_SUPABASE:
@@ -17,6 +24,153 @@ if USE_SUPABASE:
     except ImportError:
         st.error("Supabase not installed. Run: pip install supabase")
 
+# Bump when init_sqlite's tables or indexes change so existing databases are migrated
+SCHEMA_VERSION = 4
+_initialized = False
+
+# Timestamp taken by SQLite itself, in local time like the rows Python has written so far
+SQL_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+SQL_INSERT_PARTICIPANT = f"INSERT INTO participants (id, start_time, status) VALUES (?, {SQL_NOW}, ?)"
+# Buffered turns keep the time they were captured, not the time they were flushed
+SQL_INSERT_CONV = "INSERT INTO conversations (participant_id, user_message, ai_response, timestamp) VALUES (?, ?, ?, ?)"
+SQL_INSERT_CONV_NOW = f"INSERT INTO conversations (participant_id, user_message, ai_response, timestamp) VALUES (?, ?, ?, {SQL_NOW})"
+SQL_INSERT_SCENARIO = f"INSERT INTO study_scenarios (participant_id, scenario_text, initial_question, generation_timestamp) VALUES (?, ?, ?, {SQL_NOW})"
+SQL_UPDATE_PART_STATUS = f"UPDATE participants SET completion_time = {SQL_NOW}, status = ? WHERE id = ?"
+# Copies the completion time of the questionnaire row just inserted on this connection
+SQL_COMPLETE_PART_STATUS = (
+    "UPDATE participants SET completion_time = "
+    "(SELECT completion_time FROM questionnaire_responses WHERE rowid = last_insert_rowid()), "
+    "status = ? WHERE id = ?"
+)
+_QRESP_KEYS = (
+    'age', 'education', 'ct_experience',
+    'post_q1_easy_to_use', 'post_q2_felt_confident', 'post_q3_use_again', 'post_q4_engaging',
+    'post_q5_natural_flow', 'post_q6_disengagement', 'post_q7_encouraged_reflection',
+    'post_q8_multiple_perspectives', 'post_q9_critical_thinking_ways', 'post_q10_learned_something',
+    'post_q11_design_support', 'post_q12_confusion', 'post_q13_application', 'post_q14_improvements',
+    'post_q15_valuable', 'post_q16_recommend', 'post_q17_other_comments',
+    'facione_critical_thinking_score'
+)
+SQL_INSERT_QRESP = (
+    f"INSERT INTO questionnaire_responses (participant_id, {', '.join(_QRESP_KEYS)}, completion_time) "
+    f"VALUES ({', '.join('?' * (len(_QRESP_KEYS) + 1))}, {SQL_NOW})"
+)
+SQL_SELECT_FACIONE_CACHE = "SELECT score FROM facione_cache WHERE hash = ?"
+SQL_UPSERT_FACIONE_CACHE = f"INSERT OR REPLACE INTO facione_cache (hash, score, ts) VALUES (?, ?, {SQL_NOW})"
+# Questionnaires joined to participant timing and per-participant exchange counts;
+# the counts CTE filters in WHERE so it can use the partial idx_conv_pid_nnmsg index
+SQL_SELECT_POST_STUDY_STATS = """
+    WITH conv_counts AS (
+        SELECT participant_id, COUNT(*) AS total_exchanges
+        FROM conversations
+        WHERE user_message IS NOT NULL
+        GROUP BY participant_id
+    )
+    SELECT q.*, p.start_time, p.status,
+           COALESCE(cc.total_exchanges, 0) AS total_exchanges,
+           ROUND((julianday(q.completion_time) - julianday(p.start_time)) * 24 * 60, 1) AS session_duration_minutes
+    FROM participants p
+    JOIN questionnaire_responses q ON q.participant_id = p.id
+    LEFT JOIN conv_counts cc ON cc.participant_id = p.id
+    ORDER BY p.start_time
+"""
+SQL_SELECT_HIST = "SELECT user_message, ai_response FROM conversations WHERE participant_id = ? ORDER BY timestamp, id"
+
+def _open_conn() -> sqlite3.Connection:
+    """Open a SQLite connection with tuned PRAGMAs (autocommit; WAL is set once in init_sqlite)"""
+    # The per-connection statement cache keeps the fixed INSERT/SELECT strings above prepared across turns
+    conn = sqlite3.connect(DATABASE_PATH, isolation_level=None, check_same_thread=False,
+                           cached_statements=128)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    return conn
+
+def _questionnaire_row(participant_id: str, responses: Dict[str, Any]) -> tuple:
+    """Parameters for SQL_INSERT_QRESP; missing answers are stored as NULL"""
+    return (participant_id, *(responses.get(k) for k in _QRESP_KEYS))
+
+class ConnectionPool:
+    """Fixed-size pool of PRAGMA-tuned SQLite connections shared across reruns and sessions"""
+    
+    def __init__(self, pool_size: int = 4):
+        self._pool = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(_open_conn())
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, returning it to the pool afterwards"""
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+    
+    def close_all(self):
+        """Close every idle connection in the pool"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+@st.cache_resource
+def _get_pool() -> ConnectionPool:
+    pool = ConnectionPool()
+    atexit.register(pool.close_all)
+    return pool
+
+def get_db():
+    """Context manager yielding a pooled SQLite connection"""
+    return _get_pool().connection()
+
+@st.cache_resource
+def get_ro_conn() -> sqlite3.Connection:
+    """Read-only connection shared by admin reads, so its page cache stays warm between reruns"""
+    # WAL is persistent in the file, so a read-only connection needs no journal_mode PRAGMA
+    conn = sqlite3.connect(f"file:{DATABASE_PATH}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    atexit.register(conn.close)
+    return conn
+
+def _fetch_table(table: str, columns: str = '*', non_empty: Optional[str] = None) -> 'pd.DataFrame':
+    """Read a whole Supabase table in EXPORT_PAGE_SIZE pages fetched concurrently,
+    optionally only rows where the `non_empty` column is neither NULL nor ''"""
+    import pandas as pd
+    
+    def where(query):
+        return query.not_.is_(non_empty, 'null').neq(non_empty, '') if non_empty else query
+    
+    total = where(supabase_client.table(table).select('id', count='exact', head=True)).execute().count or 0
+    ranges = [(start, min(start + EXPORT_PAGE_SIZE, total) - 1) for start in range(0, total, EXPORT_PAGE_SIZE)]
+    
+    def fetch(bounds):
+        # A stable order keeps the pages from overlapping or skipping rows
+        rows = where(supabase_client.table(table).select(columns)).order('id').range(*bounds).execute().data
+        # Each page becomes a frame as it arrives, so dtypes are inferred per page rather than over every row at once
+        return pd.DataFrame.from_records(rows) if rows else None
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as executor:
+        frames = [frame for frame in executor.map(fetch, ranges) if frame is not None]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def scalar(conn: sqlite3.Connection, sql: str, params: tuple = ()):
+    """First column of the first row, for single-value queries like COUNT(*)"""
+    return conn.execute(sql, params).fetchone()[0]
+
+def db_mtime() -> float:
+    """Latest modification time of the SQLite file or its WAL, used to key cached admin reads"""
+    # Committed writes land in the -wal file until a checkpoint, so the main file alone can look stale
+    mtimes = [os.path.getmtime(path) for path in (DATABASE_PATH, f"{DATABASE_PATH}-wal") if os.path.exists(path)]
+    return max(mtimes, default=0.0)
+
 class DatabaseManager:
     """Unified database interface for SQLite and Supabase"""
     
@@ -26,66 +180,94 @@ class DatabaseManager:
             self.init_sqlite()
     
     def init_sqlite(self):
-        """Initialize SQLite database"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        c = conn.cursor()
-        
-        # Create tables
-        c.execute('''CREATE TABLE IF NOT EXISTS participants (
-            id TEXT PRIMARY KEY,
-            start_time TIMESTAMP,
-            completion_time TIMESTAMP,
-            status TEXT DEFAULT 'active'
-        )''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            participant_id TEXT,
-            user_message TEXT,
-            ai_response TEXT,
-            timestamp TIMESTAMP,
-            FOREIGN KEY (participant_id) REFERENCES participants (id)
-        )''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS questionnaire_responses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            participant_id TEXT,
-            age INTEGER,
-            education TEXT,
-            ct_experience TEXT,
-            post_q1_easy_to_use INTEGER,
-            post_q2_felt_confident INTEGER,
-            post_q3_use_again INTEGER,
-            post_q4_engaging INTEGER,
-            post_q5_natural_flow INTEGER,
-            post_q6_disengagement TEXT,
-            post_q7_encouraged_reflection INTEGER,
-            post_q8_multiple_perspectives INTEGER,
-            post_q9_critical_thinking_ways TEXT,
-            post_q10_learned_something TEXT,
-            post_q11_design_support TEXT,
-            post_q12_confusion TEXT,
-            post_q13_application TEXT,
-            post_q14_improvements TEXT,
-            post_q15_valuable INTEGER,
-            post_q16_recommend INTEGER,
-            post_q17_other_comments TEXT,
-            facione_critical_thinking_score REAL,
-            completion_time TIMESTAMP,
-            FOREIGN KEY (participant_id) REFERENCES participants (id)
-        )''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS study_scenarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            participant_id TEXT,
-            scenario_text TEXT,
-            initial_question TEXT,
-            generation_timestamp TIMESTAMP,
-            FOREIGN KEY (participant_id) REFERENCES participants (id)
-        )''')
+        """Initialize SQLite database (once per process, and only when the schema version changed)"""
+        global _initialized
+        if _initialized:
+            return
         
-        conn.commit()
-        conn.close()
+        with get_db() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+                _initialized = True
+                return
+            
+            # WAL persists in the database file, so this only needs to run once
+            conn.execute("PRAGMA journal_mode=WAL")
+            c = conn.cursor()
+            c.execute("BEGIN")
+            with conn:
+                # Create tables
+                c.execute('''CREATE TABLE IF NOT EXISTS participants (
+                    id TEXT PRIMARY KEY,
+                    start_time TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+                    completion_time TIMESTAMP,
+                    status TEXT DEFAULT 'active'
+                )''')
+                
+                c.execute('''CREATE TABLE IF NOT EXISTS conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    participant_id TEXT,
+                    user_message TEXT,
+                    ai_response TEXT,
+                    timestamp TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+                    FOREIGN KEY (participant_id) REFERENCES participants (id)
+                )''')
+                
+                c.execute('''CREATE TABLE IF NOT EXISTS questionnaire_responses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    participant_id TEXT,
+                    age INTEGER,
+                    education TEXT,
+                    ct_experience TEXT,
+                    post_q1_easy_to_use INTEGER,
+                    post_q2_felt_confident INTEGER,
+                    post_q3_use_again INTEGER,
+                    post_q4_engaging INTEGER,
+                    post_q5_natural_flow INTEGER,
+                    post_q6_disengagement TEXT,
+                    post_q7_encouraged_reflection INTEGER,
+                    post_q8_multiple_perspectives INTEGER,
+                    post_q9_critical_thinking_ways TEXT,
+                    post_q10_learned_something TEXT,
+                    post_q11_design_support TEXT,
+                    post_q12_confusion TEXT,
+                    post_q13_application TEXT,
+                    post_q14_improvements TEXT,
+                    post_q15_valuable INTEGER,
+                    post_q16_recommend INTEGER,
+                    post_q17_other_comments TEXT,
+                    facione_critical_thinking_score REAL,
+                    completion_time TIMESTAMP,
+                    FOREIGN KEY (participant_id) REFERENCES participants (id)
+                )''')
+                
+                c.execute('''CREATE TABLE IF NOT EXISTS study_scenarios (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    participant_id TEXT,
+                    scenario_text TEXT,
+                    initial_question TEXT,
+                    generation_timestamp TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+                    FOREIGN KEY (participant_id) REFERENCES participants (id)
+                )''')
+                
+                c.execute('''CREATE TABLE IF NOT EXISTS facione_cache (
+                    hash TEXT PRIMARY KEY,
+                    score REAL,
+                    ts TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+                )''')
+                
+                # Index for per-participant history lookups
+                c.execute('CREATE INDEX IF NOT EXISTS idx_conv_pid_ts ON conversations(participant_id, timestamp)')
+                # No query orders conversations by timestamp alone; drop the index older schemas created
+                c.execute('DROP INDEX IF EXISTS idx_conv_ts')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_scn_pid ON study_scenarios(participant_id)')
+                # Per-participant lookups of real exchanges and questionnaires (export JOIN, existence checks)
+                c.execute('CREATE INDEX IF NOT EXISTS idx_conv_pid_nnmsg ON conversations(participant_id) WHERE user_message IS NOT NULL')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_qr_pid ON questionnaire_responses(participant_id)')
+                # Admin stats list participants in start order
+                c.execute('CREATE INDEX IF NOT EXISTS idx_participants_start ON participants(start_time)')
+                c.execute('ANALYZE')
+                c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        _initialized = True
     
     def _execute_db_operation(self, operation_name: str, supabase_op, sqlite_op) -> bool:
         """Helper method to execute database operations with error handling"""
@@ -108,12 +290,8 @@ class DatabaseManager:
             }).execute()
         
         def sqlite_op():
-            conn = sqlite3.connect(DATABASE_PATH)
-            c = conn.cursor()
-            c.execute('''INSERT INTO participants (id, start_time, status) VALUES (?, ?, ?)''',
-                     (participant_id, datetime.now(), 'active'))
-            conn.commit()
-            conn.close()
+            with get_db() as conn, conn:
+                conn.execute(SQL_INSERT_PARTICIPANT, (participant_id, 'active'))
         
         return self._execute_db_operation("adding participant", supabase_op, sqlite_op)
     
@@ -129,38 +307,72 @@ class DatabaseManager:
                 }).execute()
                 return bool(result.data)
             else:
-                conn = sqlite3.connect(DATABASE_PATH)
-                c = conn.cursor()
-                c.execute('''INSERT INTO conversations (participant_id, user_message, ai_response, timestamp)
-                            VALUES (?, ?, ?, ?)''',
-                         (participant_id, user_msg, ai_msg, datetime.now()))
-                conn.commit()
-                conn.close()
+                with get_db() as conn, conn:
+                    conn.execute(SQL_INSERT_CONV_NOW, (participant_id, user_msg, ai_msg))
                 return True
         except Exception as e:
             st.error(f"Error saving message: {e}")
             return False
     
+    def save_messages(self, participant_id: str, messages: List[tuple]) -> bool:
+        """Save buffered (user_msg, ai_msg, timestamp) messages in a single transaction"""
+        if not messages:
+            return True
+        try:
+            if self.use_supabase:
+                result = supabase_client.table('conversations').insert([{
+                    'participant_id': participant_id,
+                    'user_message': user_msg,
+                    'ai_response': ai_msg,
+                    'timestamp': timestamp.isoformat()
+                } for user_msg, ai_msg, timestamp in messages]).execute()
+                return bool(result.data)
+            else:
+                with get_db() as conn:
+                    conn.execute("BEGIN")
+                    with conn:
+                        conn.executemany(SQL_INSERT_CONV, [
+                            (participant_id, user_msg, ai_msg, timestamp)
+                            for user_msg, ai_msg, timestamp in messages
+                        ])
+                return True
+        except Exception as e:
+            st.error(f"Error saving messages: {e}")
+            return False
+    
+    def save_scenario(self, participant_id: str, scenario_text: str, initial_question: str, initial_content: str) -> bool:
+        """Save the generated scenario and its opening conversation message in one transaction"""
+        try:
+            if self.use_supabase:
+                supabase_client.table('study_scenarios').insert({
+                    'participant_id': participant_id,
+                    'scenario_text': scenario_text,
+                    'initial_question': initial_question,
+                    'generation_timestamp': datetime.now().isoformat()
+                }).execute()
+                return self.save_message(participant_id, None, initial_content)
+            else:
+                with get_db() as conn:
+                    conn.execute("BEGIN")
+                    with conn:
+                        conn.execute(SQL_INSERT_SCENARIO, (participant_id, scenario_text, initial_question))
+                        conn.execute(SQL_INSERT_CONV_NOW, (participant_id, None, initial_content))
+                return True
+        except Exception as e:
+            st.error(f"Error saving scenario: {e}")
+            return False
+    
     def save_questionnaire(self, participant_id: str, responses: Dict[str, Any]) -> bool:
         """Save questionnaire responses"""
         try:
-            responses['participant_id'] = participant_id
-            responses['completion_time'] = datetime.now().isoformat() if self.use_supabase else datetime.now()
-            
             if self.use_supabase:
+                responses['participant_id'] = participant_id
+                responses['completion_time'] = datetime.now().isoformat()
                 result = supabase_client.table('questionnaire_responses').insert(responses).execute()
                 return bool(result.data)
             else:
-                conn = sqlite3.connect(DATABASE_PATH)
-                c = conn.cursor()
-                
-                columns = ', '.join(responses.keys())
-                placeholders = ', '.join(['?' for _ in responses])
-                
-                c.execute(f'''INSERT INTO questionnaire_responses ({columns}) VALUES ({placeholders})''',
-                         list(responses.values()))
-                conn.commit()
-                conn.close()
+                with get_db() as conn, conn:
+                    conn.execute(SQL_INSERT_QRESP, _questionnaire_row(participant_id, responses))
                 return True
         except Exception as e:
             st.error(f"Error saving questionnaire: {e}")
@@ -176,104 +388,143 @@ class DatabaseManager:
                 }).eq('id', participant_id).execute()
                 return bool(result.data)
             else:
-                conn = sqlite3.connect(DATABASE_PATH)
-                c = conn.cursor()
-                c.execute('''UPDATE participants SET completion_time = ?, status = ? WHERE id = ?''',
-                         (datetime.now(), status, participant_id))
-                conn.commit()
-                conn.close()
+                with get_db() as conn, conn:
+                    conn.execute(SQL_UPDATE_PART_STATUS, (status, participant_id))
                 return True
         except Exception as e:
             st.error(f"Error updating participant: {e}")
             return False
     
+    def complete_study(self, participant_id: str, responses: Dict[str, Any], status: str = 'completed') -> bool:
+        """Save questionnaire responses and mark the participant completed in one transaction"""
+        if self.use_supabase:
+            if not self.save_questionnaire(participant_id, responses):
+                return False
+            return self.update_participant_status(participant_id, status)
+        
+        try:
+            with get_db() as conn:
+                # Take the write lock up front so the two statements commit as one group
+                conn.execute("BEGIN IMMEDIATE")
+                with conn:
+                    # Both rows share the questionnaire's completion time
+                    conn.execute(SQL_INSERT_QRESP, _questionnaire_row(participant_id, responses))
+                    conn.execute(SQL_COMPLETE_PART_STATUS, (status, participant_id))
+                # Fold the WAL back into the database at study end rather than on every write
+                conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            return True
+        except Exception as e:
+            st.error(f"Error completing study: {e}")
+            return False
+    
+    def get_cached_facione_score(self, conversation_hash: str) -> Optional[float]:
+        """Look up a previously computed Facione score (SQLite only)"""
+        if self.use_supabase:
+            return None
+        try:
+            with get_db() as conn:
+                row = conn.execute(SQL_SELECT_FACIONE_CACHE, (conversation_hash,)).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            print(f"Facione cache lookup failed: {e}")
+            return None
+    
+    def cache_facione_score(self, conversation_hash: str, score: float) -> None:
+        """Store a Facione score for reuse on identical conversations (SQLite only)"""
+        if self.use_supabase:
+            return
+        try:
+            with get_db() as conn, conn:
+                conn.execute(SQL_UPSERT_FACIONE_CACHE, (conversation_hash, score))
+        except Exception as e:
+            print(f"Facione cache write failed: {e}")
+    
     def get_conversation_history(self, participant_id: str) -> List[tuple]:
         """Get conversation history for a participant"""
         try:
             if self.use_supabase:
-                result = supabase_client.table('conversations').select('*').eq('participant_id', participant_id).order('timestamp').execute()
-                if result.data:
-                    return [(row['user_message'], row['ai_response']) for row in result.data]
-                return []
+                result = supabase_client.table('conversations').select('user_message, ai_response').eq('participant_id', participant_id).order('timestamp').execute()
+                return [(row['user_message'], row['ai_response']) for row in result.data or []]
             else:
-                conn = sqlite3.connect(DATABASE_PATH)
-                c = conn.cursor()
-                c.execute('''SELECT user_message, ai_response FROM conversations 
-                           WHERE participant_id = ? ORDER BY timestamp''', (participant_id,))
-                messages = c.fetchall()
-                conn.close()
-                return messages
+                with get_db() as conn:
+                    return conn.execute(SQL_SELECT_HIST, (participant_id,)).fetchall()
         except Exception as e:
             st.error(f"Error getting conversation history: {e}")
             return []
     
-    def export_conversation_flow_csv(self) -> pd.DataFrame:
-        """Export conversation flows as CSV"""
-        try:
-            if self.use_supabase:
-                # Get all conversations with participant info
-                conversations = supabase_client.table('conversations').select('*').execute()
-                participants = supabase_client.table('participants').select('*').execute()
-                questionnaires = supabase_client.table('questionnaire_responses').select('*').execute()
-                
-                if not conversations.data:
-                    return pd.DataFrame()
-                
-                # Convert to DataFrames
-                conv_df = pd.DataFrame(conversations.data)
-                part_df = pd.DataFrame(participants.data) if participants.data else pd.DataFrame()
-                quest_df = pd.DataFrame(questionnaires.data) if questionnaires.data else pd.DataFrame()
-                
-            else:
-                conn = sqlite3.connect(DATABASE_PATH)
-                conv_df = pd.read_sql_query('''
-                    SELECT c.*, p.start_time as participant_start_time 
-                    FROM conversations c 
-                    LEFT JOIN participants p ON c.participant_id = p.id 
-                    ORDER BY c.participant_id, c.timestamp
-                ''', conn)
-                quest_df = pd.read_sql_query("SELECT * FROM questionnaire_responses", conn)
-                conn.close()
+    def export_conversation_flow_csv(self) -> 'pd.DataFrame':
+        """Export conversation flows as CSV; errors propagate so a cached caller never memoizes a failure"""
+        # pandas is only needed for admin exports, so keep it off the participant import path
+        import pandas as pd
+        if self.use_supabase:
+            # Get student exchanges (system messages filtered server-side) plus the questionnaire columns the export needs
+            conv_df = _fetch_table('conversations', non_empty='user_message')
+            quest_df = _fetch_table(
+                'questionnaire_responses', 'participant_id, facione_critical_thinking_score, age, education'
+            )
             
-            # Filter for actual conversations (not just system messages)
-            user_conversations = conv_df[conv_df['user_message'].notna() & (conv_df['user_message'] != '')]
+            if conv_df.empty:
+                return conv_df
             
             # Add questionnaire data if available
             if not quest_df.empty:
-                user_conversations = user_conversations.merge(
-                    quest_df[['participant_id', 'facione_critical_thinking_score', 'age', 'education']], 
-                    on='participant_id', 
-                    how='left'
-                )
+                conv_df = conv_df.merge(quest_df, on='participant_id', how='left')
             
-            return user_conversations
+        else:
+            # One query joins participant and questionnaire data onto every student exchange
+            conn = get_ro_conn()
+            conv_df = pd.read_sql_query('''
+                SELECT c.*, p.start_time as participant_start_time,
+                       q.facione_critical_thinking_score, q.age, q.education
+                FROM conversations c 
+                LEFT JOIN participants p ON c.participant_id = p.id 
+                LEFT JOIN questionnaire_responses q ON q.participant_id = c.participant_id
+                WHERE c.user_message IS NOT NULL AND c.user_message != ''
+                ORDER BY c.participant_id, c.timestamp
+            ''', conn)
+        
+        return conv_df
+
+    def export_post_study_stats(self) -> 'pd.DataFrame':
+        """Questionnaire responses with session duration and exchange count per participant; errors propagate"""
+        import pandas as pd
+        if self.use_supabase:
+            quest_df = _fetch_table('questionnaire_responses')
+            if quest_df.empty:
+                return quest_df
+            part_df = _fetch_table('participants', 'id, start_time, status')
+            conv_df = _fetch_table('conversations', 'id, participant_id', non_empty='user_message')
             
-        except Exception as e:
-            st.error(f"Error exporting conversation flow: {e}")
-            return pd.DataFrame()
+            stats = quest_df.merge(part_df, left_on='participant_id', right_on='id', suffixes=('', '_participant'))
+            stats = stats.drop(columns='id_participant')
+            counts = conv_df['participant_id'].value_counts() if not conv_df.empty else pd.Series(dtype='int64')
+            stats['total_exchanges'] = stats['participant_id'].map(counts).fillna(0).astype('int64')
+            # Timestamps without fractional seconds drop the '.ffffff' part, so parse ISO 8601 per value;
+            # utc=True lets naive and timestamptz values compare either way
+            completed = pd.to_datetime(stats['completion_time'], format='ISO8601', utc=True)
+            started = pd.to_datetime(stats['start_time'], format='ISO8601', utc=True)
+            duration = completed - started
+            stats['session_duration_minutes'] = (duration.dt.total_seconds() / 60).round(1)
+            return stats.sort_values('start_time', ignore_index=True)
+        else:
+            return pd.read_sql_query(SQL_SELECT_POST_STUDY_STATS, get_ro_conn())
 
-    def get_admin_data(self) -> Dict[str, pd.DataFrame]:
+    def get_admin_data(self) -> Dict[str, 'pd.DataFrame']:
         """Get all data for admin panel"""
+        import pandas as pd
         try:
             if self.use_supabase:
-                participants = supabase_client.table('participants').select('*').execute()
-                conversations = supabase_client.table('conversations').select('*').execute()
-                questionnaires = supabase_client.table('questionnaire_responses').select('*').execute()
-                
                 return {
-                    'participants': pd.DataFrame(participants.data if participants.data else []),
-                    'conversations': pd.DataFrame(conversations.data if conversations.data else []),
-                    'questionnaires': pd.DataFrame(questionnaires.data if questionnaires.data else [])
+                    'participants': _fetch_table('participants'),
+                    'conversations': _fetch_table('conversations'),
+                    'questionnaires': _fetch_table('questionnaire_responses')
                 }
             else:
-                conn = sqlite3.connect(DATABASE_PATH)
-                
+                conn = get_ro_conn()
                 participants_df = pd.read_sql_query("SELECT * FROM participants", conn)
                 conversations_df = pd.read_sql_query("SELECT * FROM conversations", conn)
                 questionnaires_df = pd.read_sql_query("SELECT * FROM questionnaire_responses", conn)
                 
-                conn.close()
-                
                 return {
                     'participants': participants_df,
                     'conversations': conversations_df,
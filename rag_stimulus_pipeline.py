@@ -12,6 +12,7 @@ from typing import List, Dict, Optional
 import chromadb
 from chromadb.config import Settings
 import urllib.parse
+import uuid
 
 # API keys handled by api_utils.py
 
@@ -355,8 +356,8 @@ class RAGVectorStore:
         embedding.extend([0.0] * (384 - len(embedding)))
         return embedding[:384]
     
-    def index_docs(self, docs: List[Doc]) -> None:
-        """Embed and store documents in vector database"""
+    def index_docs(self, docs: List[Doc], scope: str) -> None:
+        """Embed and store documents in vector database, tagged with the query scope that fetched them"""
         if not docs or not self.initialized:
             if not self.initialized:
                 print("Vector store not initialized - skipping document indexing")
@@ -374,9 +375,10 @@ class RAGVectorStore:
                     'title': doc.title,
                     'url': doc.url,
                     'source': doc.source,
-                    'published': doc.published or ''
+                    'published': doc.published or '',
+                    'scope': scope
                 })
-                ids.append(f"doc_{i}_{hash(doc.text)}")
+                ids.append(f"{scope}_{i}")
                 embeddings.append(self._get_embedding(doc.text))
         
         if documents:
@@ -392,8 +394,8 @@ class RAGVectorStore:
                 print(f"Document indexing failed: {e}")
                 self.initialized = False
     
-    def query(self, question: str, top_k: int = 5) -> List[Dict]:
-        """Query vector store for relevant documents"""
+    def query(self, question: str, scope: str, top_k: int = 5) -> List[Dict]:
+        """Query vector store for relevant documents among those indexed under `scope`"""
         if not self.initialized:
             print("Vector store not initialized - returning empty results")
             return []
@@ -402,6 +404,7 @@ class RAGVectorStore:
             results = self.collection.query(
                 query_embeddings=[self._get_embedding(question)],
                 n_results=top_k,
+                where={"scope": scope},
                 include=["documents", "metadatas", "distances"]
             )
             
@@ -419,6 +422,15 @@ class RAGVectorStore:
         except Exception as e:
             print(f"Query error: {e}")
             return []
+    
+    def discard(self, scope: str) -> None:
+        """Remove the documents indexed under `scope` so the shared collection stays bounded"""
+        if not self.initialized:
+            return
+        try:
+            self.collection.delete(where={"scope": scope})
+        except Exception as e:
+            print(f"Document cleanup failed: {e}")
 
 class RAGSystem:
     """Complete RAG system combining retrieval and generation with cloud fallbacks"""
@@ -427,11 +439,16 @@ class RAGSystem:
         self.retriever = DocumentRetriever()
         self.vectorstore = RAGVectorStore()
         self.rag_operational = self.vectorstore.initialized
-        
-        # Use dedicated API key for stimulus generation
+        # Warm the stimulus model; if every key fails now, the next use retries
+        model_ready = self.model is not None
+        print(f"RAG system initialized - Vector store operational: {self.rag_operational}, model ready: {model_ready}")
+    
+    @property
+    def model(self):
+        """Stimulus-generation model, looked up per use so a failed API key is rotated out; None if unavailable"""
         try:
-            from api_utils import get_model_with_retry
-            self.model = get_model_with_retry(
+            from api_utils import get_cached_model
+            return get_cached_model(
                 model_name="gemini-2.0-flash",
                 purpose='stimulus_generation',
                 temperature=0.7,
@@ -439,11 +456,9 @@ class RAGSystem:
                 top_k=50,
                 max_output_tokens=2048
             )
-            print(f"RAG system initialized - Vector store operational: {self.rag_operational}")
         except Exception as e:
             print(f"RAG model initialization failed: {e}")
-            self.model = None
-            self.rag_operational = False
+            return None
     
     def query_rag(self, question: str) -> List[Dict]:
         """Main RAG query function: retrieve, index, and return relevant documents"""
@@ -469,9 +484,14 @@ class RAGSystem:
                 print("No external docs retrieved and vector store unavailable - using fallback")
                 return self._get_fallback_docs(question)
         
-        # Normal RAG pipeline when vector store is operational
-        self.vectorstore.index_docs(docs)
-        relevant_docs = self.vectorstore.query(question, top_k=5)
+        # Normal RAG pipeline when vector store is operational. The store is shared between
+        # sessions, so each query ranks only the documents it indexed and removes them afterwards
+        scope = uuid.uuid4().hex
+        self.vectorstore.index_docs(docs, scope)
+        try:
+            relevant_docs = self.vectorstore.query(question, scope, top_k=5)
+        finally:
+            self.vectorstore.discard(scope)
         
         return relevant_docs if relevant_docs else self._get_fallback_docs(question)
     
@@ -578,13 +598,14 @@ Requirements:
 - Start directly with the scenario"""
     
     # Check if RAG model is available
-    if not rag_system or not rag_system.model:
+    model = rag_system.model if rag_system else None
+    if not model:
         print("RAG model unavailable - using hardcoded fallback scenario")
         return _get_fallback_scenario(topic)
     
     try:
         from api_utils import generate_with_retry
-        response_text = generate_with_retry(rag_system.model, stimulus_prompt)
+        response_text = generate_with_retry(model, stimulus_prompt)
         # Clean up any unwanted prefixes
         response_text = response_text.strip()
         if response_text.upper().startswith('SCENARIO:'):
@@ -629,14 +650,15 @@ Write only a single question sentence that encourages critical thinking about as
     
     try:
         # Use dedicated API key for question generation
-        from api_utils import get_model_with_retry, generate_with_retry
-        question_model = get_model_with_retry(
+        from api_utils import get_cached_model, generate_with_retry
+        from config import QUESTION_MAX_TOKENS
+        question_model = get_cached_model(
             model_name="gemini-2.0-flash",
             purpose='question_generation',
             temperature=0.4,
             top_p=0.9,
             top_k=50,
-            max_output_tokens=2048
+            max_output_tokens=QUESTION_MAX_TOKENS
         )
         question = generate_with_retry(question_model, question_prompt).strip()
         
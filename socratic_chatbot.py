@@ -4,45 +4,195 @@ RAG-enhanced version with real-world content integration
 """
 
 import asyncio
-from datetime import datetime
-from typing import Dict, List, Optional
+import heapq
+import time
+from collections import deque
+from types import MappingProxyType
+from itertools import islice
+from typing import List, Optional
 import json
 import random
+import re
 import google.generativeai as genai
 from rag_stimulus_pipeline import RAGSystem, generate_stimulus_with_question
 from academic_topic_generator import seed_concepts, make_topics, simple_select, SITUATIONS
+from config import RESPONSE_MAX_TOKENS, QUESTION_MAX_TOKENS
+
+PE_NAMES = ("purpose", "questions", "information", "inference",
+            "concepts", "assumptions", "implications", "point_of_view")
+
+# Acknowledgements that don't need the full prompt to answer well
+_TRIVIAL_INPUT_RE = re.compile(
+    r"^\s*(yes|yeah|yep|no|nope|ok(ay)?|sure|maybe|i agree|i disagree|agreed|true|"
+    r"i don'?t know|not sure|idk|i guess|i think so|fair enough)[\s.!?]*$",
+    re.IGNORECASE
+)
+TRIVIAL_INPUT_MAX_LEN = 12
+
+MAX_HISTORY_EXCHANGES = 200
+
+_EMPTY_METADATA = MappingProxyType({})
+
+# Cleanup for generated fallback openings
+_META_PREFIX_RE = re.compile(r"^(?:here'?s|here is|okay)\b[^\n]*\n", re.IGNORECASE)
+_QUESTION_LABEL_RE = re.compile(r"(?i)^question:\s*")
+
+def _strip_quote_pair(text: str) -> str:
+    """Remove one pair of surrounding double quotes, leaving unbalanced quotes alone"""
+    if len(text) >= 2 and text.startswith('"') and text.endswith('"'):
+        return text[1:-1].strip()
+    return text
+
+_PHASE_GUIDANCE = {
+    "beginning": "Use open, exploratory questions. Keep questions accessible. Create safe environment for exploration.",
+    "middle": "Use focused, probing questions. Challenge assumptions systematically. Develop critical thinking skills.",
+    "end": "Use integrative, reflective questions. Promote synthesis and metacognition."
+}
+
+_TECHNIQUES = {
+    "beginning": ("clarification", "personal_relevance", "example_seeking", "curiosity_building", "assumption_probing"),
+    "middle": ("assumption_probing", "evidence_examination", "perspective_taking", "clarification", "meta_questioning"),
+    "end": ("synthesis_building", "meta_questioning", "reflection", "perspective_taking", "evidence_examination")
+}
+
+# Static rubric shared by every turn; only the TURN JSON appended after it changes
+_RESPONSE_PROMPT_PREFIX = f"""You are a skilled Socratic educator in dialogue with a thoughtful student. Generate a natural, engaging response that develops their critical thinking.
+
+Each turn is given as JSON after "TURN:" with these fields:
+- phase: conversation phase, apply the matching PHASE GUIDANCE
+- technique: the SOCRATIC TECHNIQUE to use
+- focus: the PAUL-ELDER element to emphasise
+- student: the student's latest response
+- context: recent conversation context
+- topic: topic focus
+- rag: real-world sources relevant to the topic (may be empty)
+
+PHASE GUIDANCE:
+- beginning: {_PHASE_GUIDANCE["beginning"]}
+- middle: {_PHASE_GUIDANCE["middle"]}
+- end: {_PHASE_GUIDANCE["end"]}
+
+SOCRATIC TECHNIQUE:
+- clarification: "What do you mean when you say...?" or "Help me understand your thinking about..."
+- assumption_probing: "What are you taking for granted here?" or "What if that assumption doesn't hold?"
+- evidence_examination: "What evidence supports that view?" or "How reliable is that source?"
+- perspective_taking: "How might [stakeholder] see this differently?" or "What would the other side argue?"
+- implication_exploration: "If that's true, what follows?" or "What are the broader consequences?"
+- personal_relevance: "Have you experienced something similar?" or "How does this connect to your life?"
+- example_seeking: "Can you give me a specific instance?" or "What would that look like in practice?"
+- curiosity_building: "What puzzles you most about this?" or "What would you want to investigate?"
+- synthesis_building: "How do these ideas connect?" or "What patterns do you see?"
+- meta_questioning: "How did you arrive at that conclusion?" or "What's your thinking process here?"
+- reflection: "What have you learned about your own reasoning?" or "How has your view shifted?"
+
+PAUL-ELDER FOCUS:
+- purpose: Explore goals and intentions
+- questions: Help them generate questions
+- information: Examine evidence and data
+- inference: Look at conclusions and reasoning
+- concepts: Clarify key ideas
+- assumptions: Identify what's taken for granted
+- implications: Consider consequences
+- point_of_view: Examine different perspectives
+
+ESSENTIAL PRINCIPLES:
+1. NEVER start with formulaic praise ("That's really...", "Great point...")
+2. Begin directly with engagement of their specific ideas
+3. Show genuine curiosity about their reasoning
+4. Use their exact words and build on their concepts
+5. Ask questions that make them think deeper
+6. Keep it conversational and natural
+7. Challenge them respectfully
+8. AVOID repetitive patterns like "How would this play out?" or "Can you describe the situation?"
+9. Focus on ONE specific aspect of their response, not broad scenarios
+10. Ask about their reasoning process, not just outcomes
+
+EXAMPLES OF DIRECT ENGAGEMENT (vary your approach):
+- "You've identified something crucial about..."
+- "Following that logic, it seems like..."
+- "Your point about X raises the question of..."
+- "What you're describing sounds like..."
+- "That distinction you're making between X and Y..."
+- "The tension you've highlighted between..."
+- "When you say [their exact words], what drives that thinking?"
+- "I'm curious about how you weighed..."
+
+AVOID THESE REPETITIVE PATTERNS:
+- "How do you think this would play out?"
+- "Can you describe what might happen?"
+- "What would the situation look like?"
+- "How would this scenario develop?"
+
+Instead, focus on their specific reasoning, assumptions, or the logic behind their statements.
+
+Create a response that feels like you're genuinely thinking alongside them.
+"""
+
+_SHORT_PROBES = (
+    "What makes you uncertain about that?",
+    "Walk me through one piece of evidence you'd want to see.",
+    "What would change your mind about this?",
+    "Which part of the scenario feels most important to you, and why?",
+    "Who in this situation do you think would disagree with you, and what would they say?",
+)
+
+def create_socratic_model():
+    """Gemini model for Socratic responses (stateless, safe to share between sessions)"""
+    # Use dedicated API key for Socratic responses
+    from api_utils import get_cached_model
+    return get_cached_model(
+        model_name="gemini-2.0-flash",
+        purpose='socratic_responses',
+        temperature=0.4,
+        top_p=0.9,
+        top_k=50,
+        max_output_tokens=2048
+    )
+
+def create_rag_system() -> Optional[RAGSystem]:
+    """RAG system for real-world content, or None if it can't be initialized"""
+    try:
+        rag_system = RAGSystem()
+        print("RAG system initialized for real-world content integration")
+        return rag_system
+    except Exception as e:
+        print(f"RAG initialization failed: {e}. Using fallback content generation.")
+        return None
 
 class SocraticConversationAgent:
     """Socratic dialogue agent with adaptive questioning and RAG integration"""
     
-    def __init__(self, api_key: str):
-        # Use dedicated API key for Socratic responses
-        from api_utils import get_model_with_retry
-        self.model = get_model_with_retry(
-            model_name="gemini-2.0-flash",
-            purpose='socratic_responses',
-            temperature=0.4,
-            top_p=0.9,
-            top_k=50,
-            max_output_tokens=2048
-        )
-        self.paul_elder_coverage = {
-            "purpose": 0, "questions": 0, "information": 0, "inference": 0,
-            "concepts": 0, "assumptions": 0, "implications": 0, "point_of_view": 0
-        }
+    def __init__(self, api_key: str, model=None, rag_system: Optional[RAGSystem] = None):
+        # Model and RAG system may be shared; everything else here is per-conversation state
+        self._model = model
+        if model is None:
+            create_socratic_model()  # Fail fast if no API key works
+        # Dict view for external readers; the heap keeps the least-covered element at [0]
+        self.paul_elder_coverage = dict.fromkeys(PE_NAMES, 0)
+        self._pe_heap = [[0, name] for name in PE_NAMES]
+        heapq.heapify(self._pe_heap)
+        self._pe_entries = {entry[1]: entry for entry in self._pe_heap}
         self.conversation_phase = "beginning"
         
         # Initialize RAG system for real-world content
-        try:
-            self.rag_system = RAGSystem()
-            print("RAG system initialized for real-world content integration")
-        except Exception as e:
-            print(f"RAG initialization failed: {e}. Using fallback content generation.")
-            self.rag_system = None
+        self.rag_system = rag_system if rag_system is not None else create_rag_system()
         
         # Current conversation context for RAG
         self.current_topic = None
         self.rag_context = []
+        self._rag_refs_cached = (None, [])
+        self._probe_index = 0
+    
+    @property
+    def model(self):
+        """Injected model, or the process-wide cached one (looked up per use so a failed key is rotated out)"""
+        return self._model if self._model is not None else create_socratic_model()
+    
+    def _record_coverage(self, element: str) -> None:
+        """Increment Paul-Elder coverage for an element and restore heap order"""
+        self.paul_elder_coverage[element] += 1
+        self._pe_entries[element][0] += 1
+        heapq.heapify(self._pe_heap)
     
     def generate_opening(self, topic_hint: str = None) -> str:
         """Generate engaging Socratic opening using academic topic generator + RAG content"""
@@ -81,7 +231,7 @@ class SocraticConversationAgent:
                 stimulus_with_question = generate_stimulus_with_question(topic_hint, self.rag_system)
                 
                 if stimulus_with_question and len(stimulus_with_question.strip()) > 50:
-                    self.paul_elder_coverage["questions"] += 1
+                    self._record_coverage("questions")
                     return stimulus_with_question
                 
             except Exception as e:
@@ -119,18 +269,18 @@ Write only the question sentence with no extra text:"""
             scenario = generate_with_retry(self.model, scenario_prompt).strip()
             
             # Clean up scenario - remove any meta-commentary
-            if scenario.lower().startswith(("here's", "okay", "here is")):
-                lines = scenario.split('\n')
-                if len(lines) > 1:
-                    scenario = '\n'.join(lines[1:]).strip()
+            scenario = _META_PREFIX_RE.sub("", scenario, count=1).strip()
             
             # Generate question
-            question = generate_with_retry(self.model, question_prompt).strip()
-            question = question.replace("Question:", "").replace("QUESTION:", "").strip()
-            if question.startswith('"') and question.endswith('"'):
-                question = question[1:-1].strip()
+            question = generate_with_retry(
+                self.model, question_prompt,
+                generation_config={"max_output_tokens": QUESTION_MAX_TOKENS}
+            ).strip()
+            # Quotes can wrap the label ("Question: ...") or follow it (Question: "...")
+            question = _strip_quote_pair(question)
+            question = _strip_quote_pair(_QUESTION_LABEL_RE.sub("", question).strip())
             
-            self.paul_elder_coverage["questions"] += 1
+            self._record_coverage("questions")
             return f"{scenario}\n\n{question}"
             
         except Exception as e:
@@ -139,125 +289,86 @@ Write only the question sentence with no extra text:"""
             question = "What assumptions might be driving the different positions you see here?"
             return f"{scenario}\n\n{question}"
     
+    def _rag_refs(self) -> List[str]:
+        """Source/title references for the top RAG docs, reused until rag_context is replaced"""
+        # Holding the list itself (not its id) means a freed list's id can't be reused for a stale hit
+        context = self.rag_context
+        if self._rag_refs_cached[0] is not context:
+            refs = []
+            for doc in context[:2]:  # Use top 2 most relevant
+                metadata = doc.get('metadata') or _EMPTY_METADATA
+                refs.append(f"[{metadata.get('source', 'Source')}: {metadata.get('title', 'Context')}]")
+            self._rag_refs_cached = (context, refs)
+        return self._rag_refs_cached[1]
+    
     def respond_to_student(self, student_response: str, conversation_context: str) -> str:
         """Generate adaptive Socratic response with RAG context awareness"""
         
+        # Fast path: answer bare acknowledgements with a canned probe, skipping the LLM call
+        stripped = student_response.strip()
+        if len(stripped) < TRIVIAL_INPUT_MAX_LEN or _TRIVIAL_INPUT_RE.match(stripped):
+            probe = _SHORT_PROBES[self._probe_index % len(_SHORT_PROBES)]
+            self._probe_index += 1
+            self._record_coverage("questions")
+            return probe
+        
         # Determine conversation phase based on exchange count
         exchange_count = self.paul_elder_coverage["questions"]
         
         if exchange_count <= 3:
             phase = "beginning"
-            phase_guidance = "Use open, exploratory questions. Keep questions accessible. Create safe environment for exploration."
         elif exchange_count <= 8:
-            phase = "middle"  
-            phase_guidance = "Use focused, probing questions. Challenge assumptions systematically. Develop critical thinking skills."
+            phase = "middle"
         else:
             phase = "end"
-            phase_guidance = "Use integrative, reflective questions. Promote synthesis and metacognition."
         
         # Choose Socratic technique based on phase with variety
-        techniques = {
-            "beginning": ["clarification", "personal_relevance", "example_seeking", "curiosity_building", "assumption_probing"],
-            "middle": ["assumption_probing", "evidence_examination", "perspective_taking", "clarification", "meta_questioning"],
-            "end": ["synthesis_building", "meta_questioning", "reflection", "perspective_taking", "evidence_examination"]
-        }
+        phase_techniques = _TECHNIQUES[phase]
         
         # Avoid overusing implication_exploration which leads to "how would this play out" questions
-        available_techniques = [t for t in techniques[phase] if t != "implication_exploration" or random.random() < 0.3]
-        technique = random.choice(available_techniques if available_techniques else techniques[phase])
+        available_techniques = [t for t in phase_techniques if t != "implication_exploration" or random.random() < 0.3]
+        technique = random.choice(available_techniques if available_techniques else phase_techniques)
         
         # Choose Paul-Elder focus (balance coverage)
-        paul_elder_elements = ["purpose", "questions", "information", "inference", 
-                             "concepts", "assumptions", "implications", "point_of_view"]
-        least_covered = min(self.paul_elder_coverage.items(), key=lambda x: x[1])[0]
+        least_covered = self._pe_heap[0][1]
         
         # Build context from RAG if available
-        rag_context_text = ""
-        if self.rag_context and self.current_topic:
-            context_parts = []
-            for doc in self.rag_context[:2]:  # Use top 2 most relevant
-                source = doc.get('metadata', {}).get('source', 'Source')
-                title = doc.get('metadata', {}).get('title', 'Context')
-                context_parts.append(f"[{source}: {title}]")
-            rag_context_text = f"\nREAL-WORLD CONTEXT: {' | '.join(context_parts)}"
+        rag_refs = self._rag_refs() if self.rag_context and self.current_topic else []
         
-        response_prompt = f"""You are a skilled Socratic educator in dialogue with a thoughtful student. Generate a natural, engaging response that develops their critical thinking.
-
-CONVERSATION PHASE: {phase}
-PHASE GUIDANCE: {phase_guidance}
-
-STUDENT RESPONSE: "{student_response}"
-CONVERSATION CONTEXT: {conversation_context}
-TOPIC FOCUS: {self.current_topic or 'general critical thinking'}{rag_context_text}
-
-SOCRATIC TECHNIQUE: {technique}
-- clarification: "What do you mean when you say...?" or "Help me understand your thinking about..."
-- assumption_probing: "What are you taking for granted here?" or "What if that assumption doesn't hold?"  
-- evidence_examination: "What evidence supports that view?" or "How reliable is that source?"
-- perspective_taking: "How might [stakeholder] see this differently?" or "What would the other side argue?"
-- implication_exploration: "If that's true, what follows?" or "What are the broader consequences?"
-- personal_relevance: "Have you experienced something similar?" or "How does this connect to your life?"
-- example_seeking: "Can you give me a specific instance?" or "What would that look like in practice?"
-- curiosity_building: "What puzzles you most about this?" or "What would you want to investigate?"
-- synthesis_building: "How do these ideas connect?" or "What patterns do you see?"
-- meta_questioning: "How did you arrive at that conclusion?" or "What's your thinking process here?"
-- reflection: "What have you learned about your own reasoning?" or "How has your view shifted?"
-
-PAUL-ELDER FOCUS: {least_covered}
-- purpose: Explore goals and intentions
-- questions: Help them generate questions
-- information: Examine evidence and data  
-- inference: Look at conclusions and reasoning
-- concepts: Clarify key ideas
-- assumptions: Identify what's taken for granted
-- implications: Consider consequences
-- point_of_view: Examine different perspectives
-
-ESSENTIAL PRINCIPLES:
-1. NEVER start with formulaic praise ("That's really...", "Great point...")
-2. Begin directly with engagement of their specific ideas
-3. Show genuine curiosity about their reasoning
-4. Use their exact words and build on their concepts
-5. Ask questions that make them think deeper
-6. Keep it conversational and natural
-7. Challenge them respectfully
-8. AVOID repetitive patterns like "How would this play out?" or "Can you describe the situation?"
-9. Focus on ONE specific aspect of their response, not broad scenarios
-10. Ask about their reasoning process, not just outcomes
-
-EXAMPLES OF DIRECT ENGAGEMENT (vary your approach):
-- "You've identified something crucial about..."
-- "Following that logic, it seems like..."
-- "Your point about X raises the question of..."
-- "What you're describing sounds like..."
-- "That distinction you're making between X and Y..."
-- "The tension you've highlighted between..."
-- "When you say [their exact words], what drives that thinking?"
-- "I'm curious about how you weighed..."
-
-AVOID THESE REPETITIVE PATTERNS:
-- "How do you think this would play out?"
-- "Can you describe what might happen?"
-- "What would the situation look like?"
-- "How would this scenario develop?"
-
-Instead, focus on their specific reasoning, assumptions, or the logic behind their statements.
-
-Create a response that feels like you're genuinely thinking alongside them."""
+        # Per-turn data only; the rubric lives in the static prefix
+        payload = json.dumps({
+            "phase": phase,
+            "technique": technique,
+            "focus": least_covered,
+            "student": student_response,
+            "context": conversation_context,
+            "topic": self.current_topic or 'general critical thinking',
+            "rag": rag_refs
+        }, ensure_ascii=False, separators=(',', ':'))
+        response_prompt = _RESPONSE_PROMPT_PREFIX + "\nTURN:\n" + payload
 
+        model = self.model
         try:
-            response = self.model.generate_content(response_prompt)
-            self.paul_elder_coverage[least_covered] += 1
+            response = model.generate_content(
+                response_prompt,
+                generation_config={"max_output_tokens": RESPONSE_MAX_TOKENS, "stop_sequences": ["\n\n"]}
+            )
+            self._record_coverage(least_covered)
             return response.text.strip()
         except Exception as e:
+            # Single attempt here, so only a rejected key (not a transient rate limit) drops the cached model
+            from api_utils import invalidate_cached_model, is_key_error, is_retryable_error
+            if is_key_error(e) and not is_retryable_error(e):
+                invalidate_cached_model(model)
             return f"That's an interesting perspective. What led you to that conclusion? Can you help me understand your reasoning?"
 
 class SimplifiedOrchestrator:
     """RAG-enhanced orchestrator for human study integration"""
     
-    def __init__(self, api_key: str):
-        self.conversation_agent = SocraticConversationAgent(api_key)
-        self.conversation_history = []
+    def __init__(self, api_key: str, model=None, rag_system: Optional[RAGSystem] = None):
+        self.conversation_agent = SocraticConversationAgent(api_key, model=model, rag_system=rag_system)
+        # Bounded; exchanges are also persisted to the database by the Streamlit app
+        self.conversation_history = deque(maxlen=MAX_HISTORY_EXCHANGES)
         self.exchange_count = 0
         self.current_scenario = None
     
@@ -273,7 +384,7 @@ class SimplifiedOrchestrator:
         opening_exchange = {
             "type": "opening",
             "educator_response": full_opening,
-            "timestamp": datetime.utcnow().isoformat(),
+            "ts": time.time_ns(),
             "socratic_technique": "academic_rag_opening",
             "topic": self.conversation_agent.current_topic
         }
@@ -293,9 +404,9 @@ class SimplifiedOrchestrator:
         # Get conversation context
         context = self._get_conversation_context()
         
-        # Generate Socratic response
-        educator_response = self.conversation_agent.respond_to_student(
-            student_response, context
+        # Generate Socratic response in a worker thread so the blocking LLM call doesn't hold the event loop
+        educator_response = await asyncio.to_thread(
+            self.conversation_agent.respond_to_student, student_response, context
         )
         
         # Log exchange
@@ -303,7 +414,7 @@ class SimplifiedOrchestrator:
             "type": "dialogue", 
             "student_response": student_response,
             "educator_response": educator_response,
-            "timestamp": datetime.utcnow().isoformat(),
+            "ts": time.time_ns(),
             "exchange_number": self.exchange_count
         }
         
@@ -313,10 +424,11 @@ class SimplifiedOrchestrator:
     
     def _get_conversation_context(self, last_n: int = 3) -> str:
         """Get recent conversation context"""
-        if len(self.conversation_history) <= 1:
+        history_len = len(self.conversation_history)
+        if history_len <= 1:
             return "Beginning of conversation."
         
-        recent = self.conversation_history[-last_n:]
+        recent = islice(self.conversation_history, max(0, history_len - last_n), None)
         context_parts = []
         
         for exchange in recent:
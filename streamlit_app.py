@@ -12,26 +12,48 @@ except ImportError:
     pass
 
 import streamlit as st
+import asyncio
+import atexit
+import concurrent.futures
+import threading
 import uuid
+import re
 import json
-import pandas as pd
+import hashlib
+import io
 from datetime import datetime
-from socratic_chatbot import SimplifiedOrchestrator
-from api_utils import get_model_with_retry, generate_with_retry
 import os
-from database_manager import db_manager
-import sqlite3
+from database_manager import db_manager, get_ro_conn, db_mtime, scalar
 
 # Configuration
-from config import GEMINI_API_KEY, DATABASE_PATH
+from config import GEMINI_API_KEY, FACIONE_CACHE_ENABLED, MESSAGE_FLUSH_SIZE
 
 
 API_KEY = GEMINI_API_KEY
 
+LIKERT = {1: "Strongly Disagree", 2: "Disagree", 3: "Neutral", 4: "Agree", 5: "Strongly Agree"}
+# Slider labels built once; options stay 1-5 so stored answers are unchanged
+LIKERT_LABELS = {x: f"{x} - {label}" for x, label in LIKERT.items()}
+LIKERT_FMT = LIKERT_LABELS.__getitem__
+
+SCENARIO_TAG = "**SCENARIO:**"
+QUESTION_TAG = "**QUESTION:**"
+
+_SCORE_RE = re.compile(r'"ai_score"\s*:\s*([-+]?\d+(?:\.\d+)?)')
+
+
+@st.cache_data(ttl=600, max_entries=64)
+def _cached_conversation_history(participant_id, version):
+    """Read history from the database; `version` changes whenever a message is saved"""
+    return db_manager.get_conversation_history(participant_id)
+
 def get_conversation_history(participant_id):
     """Get conversation history for a participant"""
+    # This session's messages are kept in memory once hydrated; only resumed sessions hit the database
+    if participant_id == st.session_state.get('participant_id') and 'rendered_messages' in st.session_state:
+        return [(user_msg, ai_msg) for user_msg, ai_msg, _ in st.session_state.rendered_messages]
     try:
-        return db_manager.get_conversation_history(participant_id)
+        return _cached_conversation_history(participant_id, st.session_state.get('msg_version', 0))
     except:
         return []
 
@@ -40,27 +62,117 @@ def init_database():
     # Database initialization is now handled by db_manager
     pass
 
+def _render_entry(user_msg, ai_msg):
+    """Precompute how a stored message is displayed, splitting scenario/question messages once"""
+    parts = None
+    # Scenario messages are always saved with the scenario tag first
+    if ai_msg and ai_msg.startswith(SCENARIO_TAG):
+        scenario_part, _, question_part = ai_msg.partition(QUESTION_TAG)
+        parts = (scenario_part[len(SCENARIO_TAG):].strip(), question_part.strip())
+    return (user_msg, ai_msg, parts)
+
+def flush_messages():
+    """Write buffered chat messages to the database in one transaction"""
+    pending = st.session_state.get('pending_writes')
+    if not pending:
+        return True
+    saved = db_manager.save_messages(st.session_state.participant_id, pending)
+    if saved:
+        pending.clear()
+        # Invalidate the cached history for this session
+        st.session_state.msg_version = st.session_state.get('msg_version', 0) + 1
+    return saved
+
 def save_message(participant_id, user_msg, ai_msg):
-    """Save conversation to database"""
-    return db_manager.save_message(participant_id, user_msg, ai_msg)
+    """Buffer a conversation message, flushing to the database every MESSAGE_FLUSH_SIZE messages"""
+    st.session_state.setdefault('pending_writes', []).append((user_msg, ai_msg, datetime.now()))
+    if 'rendered_messages' in st.session_state:
+        st.session_state.rendered_messages.append(_render_entry(user_msg, ai_msg))
+    if len(st.session_state.pending_writes) >= MESSAGE_FLUSH_SIZE:
+        return flush_messages()
+    return True
+
+def save_scenario(participant_id, stimulus, question):
+    """Save the opening scenario and its seed chat message together"""
+    # Keep buffered turns ahead of the seed in timestamp order
+    flush_messages()
+    initial_content = f"{SCENARIO_TAG}\n{stimulus}\n\n{QUESTION_TAG}\n{question}"
+    saved = db_manager.save_scenario(participant_id, stimulus, question, initial_content)
+    if 'rendered_messages' in st.session_state:
+        # Pieces are already known here, so skip re-parsing the tagged message
+        st.session_state.rendered_messages.append((None, initial_content, (stimulus.strip(), question.strip())))
+    st.session_state.msg_version = st.session_state.get('msg_version', 0) + 1
+    return saved
 
 def save_questionnaire_responses(participant_data):
     """Save all questionnaire responses to database"""
     participant_id = st.session_state.participant_id
     
-    # Save questionnaire data
-    success = db_manager.save_questionnaire(participant_id, participant_data)
-    
-    # Update participant status
-    if success:
-        db_manager.update_participant_status(participant_id, 'completed')
-    
-    return success
-
-def score_conversation_facione(scenario, question, conversation_history):
-    """Score the entire conversation using Facione framework"""
-    
-    FACIONE_SYSTEM_PROMPT = """You are a highly trained expert in educational assessment, specialising in evaluating critical thinking using the Facione framework.
+    # Buffered chat turns must be stored before the participant is marked completed
+    if not flush_messages():
+        return False
+    
+    # Save questionnaire data and update participant status together
+    return db_manager.complete_study(participant_id, participant_data)
+
+@st.cache_resource
+def _event_loop():
+    """Background event loop shared by all sessions for orchestrator coroutines"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    atexit.register(loop.call_soon_threadsafe, loop.stop)
+    return loop
+
+@st.cache_resource
+def _scoring_executor():
+    """Worker pool for Facione scoring, so End Study doesn't wait on the Gemini call"""
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="facione")
+    atexit.register(executor.shutdown, wait=False)
+    return executor
+
+def _resolve_facione_score(timeout=10):
+    """Collect the background Facione score, falling back to the neutral 2.5 if it isn't ready"""
+    future = st.session_state.pop('facione_future', None)
+    if future is not None:
+        try:
+            st.session_state.facione_score = future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Scoring failed: {e}")
+            st.session_state.facione_score = 2.5  # Default fallback
+        print(f"Facione score for participant {st.session_state.participant_id}: {st.session_state.facione_score}")
+    return st.session_state.get('facione_score', 2.5)
+
+@st.cache_resource
+def _shared_rag_system():
+    """RAG system shared by every session's orchestrator (the Gemini model is cached in api_utils)"""
+    from socratic_chatbot import create_rag_system
+    rag_system = create_rag_system()
+    # Raising keeps st.cache_resource from holding on to a degraded instance
+    if rag_system is None or not rag_system.rag_operational:
+        raise RuntimeError("RAG vector store unavailable")
+    return rag_system
+
+def _session_rag_system():
+    """Shared RAG system, or None so this session's orchestrator builds (and retries) its own"""
+    try:
+        return _shared_rag_system()
+    except RuntimeError as e:
+        print(f"{e}; falling back to a per-session RAG system")
+        return None
+
+def _facione_model():
+    """Gemini model used for Facione scoring, shared across sessions"""
+    from api_utils import get_cached_model
+    return get_cached_model(
+        model_name="gemini-2.0-flash",
+        purpose='stimulus_generation',
+        temperature=0.1,
+        top_p=0.9,
+        top_k=50,
+        max_output_tokens=1024
+    )
+
+FACIONE_SYSTEM_PROMPT = """You are a highly trained expert in educational assessment, specialising in evaluating critical thinking using the Facione framework.
 
 **Scoring Instructions**  
 Assign a floating-point score between **1.0 and 4.0** (e.g., 1.3, 2.8, 3.9).  
@@ -78,14 +190,7 @@ You return only floating-point scores in strict JSON format:
 
 Be analytical, thoughtful, and fair. You play a vital role in nurturing students' critical thinking potential."""
 
-    # Build conversation text
-    conversation_text = f"Original Scenario: {scenario}\nInitial Question: {question}\n\nConversation:\n"
-    
-    for i, (user_msg, ai_msg) in enumerate(conversation_history, 1):
-        if user_msg:  # Skip empty user messages
-            conversation_text += f"Student {i}: {user_msg}\nEducator {i}: {ai_msg}\n\n"
-    
-    user_prompt = f"""You are a qualified academic marker trained in evaluating critical thinking in student writing.
+FACIONE_USER_PROMPT = """You are a qualified academic marker trained in evaluating critical thinking in student writing.
 
 **CONVERSATION CONTEXT:**
 This was a Socratic dialogue about critical thinking. The student engaged with an AI tutor discussing a real-world ethical dilemma.
@@ -120,28 +225,47 @@ e.g.:
 
 No explanation. No labels. Just the JSON."""
 
+# Built once at import; the system prompt's literal JSON braces are escaped for format_map
+FACIONE_PROMPT_TEMPLATE = (FACIONE_SYSTEM_PROMPT.replace("{", "{{").replace("}", "}}")
+                           + "\n\n" + FACIONE_USER_PROMPT)
+
+def score_conversation_facione(scenario, question, conversation_history):
+    """Score the entire conversation using Facione framework"""
+    # Build conversation text
+    parts = [f"Original Scenario: {scenario}\nInitial Question: {question}\n\nConversation:\n"]
+    
+    for i, (user_msg, ai_msg) in enumerate(conversation_history, 1):
+        if user_msg:  # Skip empty user messages
+            parts.append(f"Student {i}: {user_msg}\nEducator {i}: {ai_msg}\n\n")
+    
+    conversation_text = "".join(parts)
+    
+    cache_key = None
+    if FACIONE_CACHE_ENABLED:
+        cache_key = hashlib.sha256(conversation_text.encode('utf-8')).hexdigest()
+        cached_score = db_manager.get_cached_facione_score(cache_key)
+        if cached_score is not None:
+            return cached_score
+    
     try:
-        # Use existing API setup
-        model = get_model_with_retry(
-            model_name="gemini-2.0-flash",
-            purpose='stimulus_generation',
-            temperature=0.1,
-            top_p=0.9,
-            top_k=50,
-            max_output_tokens=1024
-        )
+        model = _facione_model()
         
-        response = generate_with_retry(model, f"{FACIONE_SYSTEM_PROMPT}\n\n{user_prompt}")
+        prompt = FACIONE_PROMPT_TEMPLATE.format_map({"conversation_text": conversation_text})
+        from api_utils import generate_with_retry
+        response = generate_with_retry(model, prompt)
         
-        # Parse JSON response
-        response = response.strip()
-        if response.startswith('```json'):
-            response = response[7:-3].strip()
-        elif response.startswith('```'):
-            response = response[3:-3].strip()
-            
-        score_data = json.loads(response)
-        return float(score_data.get("ai_score", 2.5))
+        # Known {"ai_score": x} shape: regex first, full JSON parse only on a miss
+        m = _SCORE_RE.search(response)
+        if m:
+            score = float(m.group(1))
+        else:
+            text = response.strip()
+            if text.startswith('```'):
+                text = text.strip('`').removeprefix('json').strip()
+            score = float(json.loads(text)['ai_score'])
+        if cache_key:
+            db_manager.cache_facione_score(cache_key, score)
+        return score
         
     except Exception as e:
         print(f"Facione scoring error: {e}")
@@ -211,7 +335,9 @@ def main():
     # Initialize orchestrator after consent is given
     if 'orchestrator' not in st.session_state:
         try:
-            st.session_state.orchestrator = SimplifiedOrchestrator(API_KEY)
+            # Chat stack (Gemini client, ChromaDB) is only imported once a participant reaches the study
+            from socratic_chatbot import SimplifiedOrchestrator
+            st.session_state.orchestrator = SimplifiedOrchestrator(API_KEY, rag_system=_session_rag_system())
         except Exception as e:
             st.error(f"Failed to initialise chatbot system: {e}")
             st.info("Please contact the study administrators if this error persists.")
@@ -241,8 +367,7 @@ def main():
                 st.session_state.stimulus_generated = True
                 
                 # Save the initial scenario and question to database
-                initial_content = f"**SCENARIO:**\n{stimulus}\n\n**QUESTION:**\n{question}"
-                save_message(st.session_state.participant_id, None, initial_content)
+                save_scenario(st.session_state.participant_id, stimulus, question)
                 
             except Exception as e:
                 st.error(f"Error generating topic: {e}")
@@ -251,28 +376,29 @@ def main():
                 st.session_state.stimulus_generated = True
                 
                 # Save fallback scenario to database
-                initial_content = f"**SCENARIO:**\n{st.session_state.stimulus}\n\n**QUESTION:**\n{st.session_state.question}"
-                save_message(st.session_state.participant_id, None, initial_content)
+                save_scenario(st.session_state.participant_id, st.session_state.stimulus, st.session_state.question)
     
     # Chat interface
     st.subheader("Discussion")
     
-    # Display conversation history
-    messages = get_conversation_history(st.session_state.participant_id)
+    # Display conversation history (hydrated from the database once per session)
+    if 'rendered_messages' not in st.session_state:
+        flush_messages()
+        st.session_state.rendered_messages = [
+            _render_entry(user_msg, ai_msg)
+            for user_msg, ai_msg in get_conversation_history(st.session_state.participant_id)
+        ]
     
-    for user_msg, ai_msg in messages:
+    for user_msg, ai_msg, parts in st.session_state.rendered_messages:
         if user_msg:  # Student response
             with st.chat_message("user"):
                 st.write(user_msg)
         
         # AI response 
         with st.chat_message("assistant"):
-            if "**SCENARIO:**" in ai_msg and "**QUESTION:**" in ai_msg:
-                # Split scenario and question for separate boxes
-                parts = ai_msg.split("**QUESTION:**")
-                scenario_part = parts[0].replace("**SCENARIO:**", "").strip()
-                question_part = parts[1].strip() if len(parts) > 1 else ""
-                
+            if parts:
+                # Scenario and question in separate boxes
+                scenario_part, question_part = parts
                 st.info(f"**SCENARIO:**\n{scenario_part}")
                 st.warning(f"**QUESTION:**\n{question_part}")
             else:
@@ -286,45 +412,43 @@ def main():
         
         # Get AI response
         try:
-            import asyncio
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            ai_response = loop.run_until_complete(
+            ai_response = asyncio.run_coroutine_threadsafe(
                 st.session_state.orchestrator.handle_student_input(
                     st.session_state.participant_id, prompt
-                )
-            )
+                ),
+                _event_loop()
+            ).result()
             
             # Display AI response
             st.chat_message("assistant").write(ai_response)
             
-            # Save to database
+            # Save to database; the turn is already painted above, so no full rerun is needed
             save_message(st.session_state.participant_id, prompt, ai_response)
             
-            # Rerun to update display
-            st.rerun()
-            
         except Exception as e:
             st.error(f"Error: {e}")
             st.chat_message("assistant").write("I apologise, but I'm having difficulty responding. Could you rephrase your question?")
     
     # End study button
     if st.button("End Study", type="secondary"):
-        # Score the conversation using Facione framework
-        with st.spinner("Evaluating conversation..."):
-            try:
-                conversation_history = get_conversation_history(st.session_state.participant_id)
-                scenario = getattr(st.session_state, 'stimulus', 'No scenario available')
-                question = getattr(st.session_state, 'question', 'No question available')
-                
-                facione_score = score_conversation_facione(scenario, question, conversation_history)
-                st.session_state.facione_score = facione_score
-                print(f"Facione score for participant {st.session_state.participant_id}: {facione_score}")
-                
-            except Exception as e:
-                print(f"Scoring failed: {e}")
-                st.session_state.facione_score = 2.5  # Default fallback
+        # Don't leave the chat until every buffered turn is saved
+        if not flush_messages():
+            st.error("Your latest messages could not be saved. Please click End Study again.")
+            return
+        
+        # Score the conversation using Facione framework in the background;
+        # the result is collected when the post-questionnaire is submitted
+        try:
+            conversation_history = get_conversation_history(st.session_state.participant_id)
+            scenario = getattr(st.session_state, 'stimulus', 'No scenario available')
+            question = getattr(st.session_state, 'question', 'No question available')
+            
+            st.session_state.facione_future = _scoring_executor().submit(
+                score_conversation_facione, scenario, question, conversation_history
+            )
+        except Exception as e:
+            print(f"Scoring failed: {e}")
+            st.session_state.facione_score = 2.5  # Default fallback
         
         st.session_state.conversation_ended = True
         st.rerun()
@@ -464,35 +588,35 @@ def show_post_questionnaire():
         st.subheader("Usability")
         q1 = st.select_slider("1. I found the chatbot easy to use.", 
                              options=[1, 2, 3, 4, 5], 
-                             format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                             format_func=LIKERT_FMT)
         
         q2 = st.select_slider("2. I felt confident interacting with the chatbot.", 
                              options=[1, 2, 3, 4, 5], 
-                             format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                             format_func=LIKERT_FMT)
         
         q3 = st.select_slider("3. I would be happy to use this chatbot again.", 
                              options=[1, 2, 3, 4, 5], 
-                             format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                             format_func=LIKERT_FMT)
         
         st.subheader("Engagement")
         q4 = st.select_slider("4. I found the chatbot engaging.", 
                              options=[1, 2, 3, 4, 5], 
-                             format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                             format_func=LIKERT_FMT)
         
         q5 = st.select_slider("5. The flow of conversation felt natural.", 
                              options=[1, 2, 3, 4, 5], 
-                             format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                             format_func=LIKERT_FMT)
         
         q6 = st.text_area("6. Did you ever feel bored, stuck, or disengaged during the chat? Please explain.")
         
         st.subheader("Learning & Critical Thinking")
         q7 = st.select_slider("7. The chatbot encouraged me to reflect on my own thinking.", 
                              options=[1, 2, 3, 4, 5], 
-                             format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                             format_func=LIKERT_FMT)
         
         q8 = st.select_slider("8. The chatbot helped me to consider multiple perspectives.", 
                              options=[1, 2, 3, 4, 5], 
-                             format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                             format_func=LIKERT_FMT)
         
         q9 = st.text_area("9. In what ways, if any, did the chatbot make you think more critically?")
         
@@ -512,11 +636,11 @@ def show_post_questionnaire():
         st.subheader("Overall Impression")
         q15 = st.select_slider("15. Overall, I found the chatbot valuable.", 
                               options=[1, 2, 3, 4, 5], 
-                              format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                              format_func=LIKERT_FMT)
         
         q16 = st.select_slider("16. I would recommend this chatbot to others.", 
                               options=[1, 2, 3, 4, 5], 
-                              format_func=lambda x: f"{x} - {'Strongly Disagree' if x==1 else 'Disagree' if x==2 else 'Neutral' if x==3 else 'Agree' if x==4 else 'Strongly Agree'}")
+                              format_func=LIKERT_FMT)
         
         q17 = st.text_area("17. Please add any other comments or suggestions.")
         
@@ -542,11 +666,13 @@ def show_post_questionnaire():
                 'post_q15_valuable': q15,
                 'post_q16_recommend': q16,
                 'post_q17_other_comments': q17,
-                'facione_critical_thinking_score': getattr(st.session_state, 'facione_score', 2.5)
+                'facione_critical_thinking_score': _resolve_facione_score()
             })
             
             # Save questionnaire responses to database
-            save_questionnaire_responses(st.session_state.participant_data)
+            if not save_questionnaire_responses(st.session_state.participant_data):
+                st.error("Your responses could not be saved. Please submit again.")
+                return
             
             st.session_state.post_questionnaire_completed = True
             st.rerun()
@@ -559,14 +685,45 @@ def show_thank_you():
     
     st.write("Your responses have been recorded. Thank you for contributing to our research on critical thinking and AI-powered educational tools.")
 
-def create_conversation_flow_csv():
+def _csv_bytes(df):
+    """Encode a DataFrame as UTF-8 CSV bytes without building an intermediate str"""
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding='utf-8')
+    return buf.getvalue()
+
+# Low-cardinality text columns; as categoricals they are dictionary-encoded in Parquet
+PARQUET_CATEGORICAL_COLUMNS = ('participant_id', 'status', 'education', 'ct_experience')
+
+def _parquet_bytes(df):
+    """Encode a DataFrame as snappy Parquet, or None when no Parquet engine is installed"""
+    categorical = {c: 'category' for c in PARQUET_CATEGORICAL_COLUMNS if c in df.columns}
+    try:
+        buf = io.BytesIO()
+        df.astype(categorical).to_parquet(buf, index=False, compression='snappy')
+        return buf.getvalue()
+    except ImportError:
+        return None
+
+# Exports are memoized on the database mtime, so repeat downloads skip the queries until data changes.
+# Supabase has no local file (db_version is always 0.0), so there the ttl alone bounds staleness.
+@st.cache_data(ttl=60, max_entries=4)
+def create_conversation_flow_csv(db_version=None):
     """Create a formatted CSV with conversation flows for each participant"""
     return db_manager.export_conversation_flow_csv()
 
-def create_post_study_stats_csv():
+def _downcast(df):
+    """Shrink numeric columns to the smallest dtype that holds them (Likert answers fit in uint8)"""
+    import pandas as pd
+    for c in df.select_dtypes('integer').columns:
+        df[c] = pd.to_numeric(df[c], downcast='unsigned' if (df[c] >= 0).all() else 'integer')
+    for c in df.select_dtypes('float').columns:
+        df[c] = pd.to_numeric(df[c], downcast='float')
+    return df
+
+@st.cache_data(ttl=60, max_entries=4)
+def create_post_study_stats_csv(db_version=None):
     """Create CSV with post-study questionnaire responses and conversation stats"""
-    admin_data = db_manager.get_admin_data()
-    return admin_data['questionnaires']
+    return _downcast(db_manager.export_post_study_stats())
 
 def test_rag_system():
     """Test RAG system components for debugging"""
@@ -634,143 +791,163 @@ def test_rag_system():
     
     return test_results
 
-def show_admin_panel():
-    """Show admin panel for data export - add ?admin=true to URL"""
-    st.title("🔧 Study Admin Panel")
+@st.cache_data(ttl=30)
+def _study_overview(db_version):
+    """Participant, completion and exchange counts for the admin overview (db_version is the cache key)"""
+    conn = get_ro_conn()
+    return (
+        scalar(conn, "SELECT COUNT(*) FROM participants"),
+        scalar(conn, "SELECT COUNT(*) FROM questionnaire_responses"),
+        scalar(conn, "SELECT COUNT(*) FROM conversations WHERE user_message IS NOT NULL"),
+    )
+
+def _render_data_export():
+    """Admin export buttons and study overview"""
+    # Export options
+    st.subheader("Download Study Data")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        if st.button("Post-Study Questionnaires + Stats", type="primary"):
+            try:
+                df = create_post_study_stats_csv(db_mtime())
+                csv = _csv_bytes(df)
+                st.download_button(
+                    label="Download Post-Study Data CSV",
+                    data=csv,
+                    file_name=f"post_study_questionnaires_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime="text/csv"
+                )
+                st.success(f"Generated CSV with {len(df)} completed participants")
+            except Exception as e:
+                st.error(f"Error creating post-study CSV: {e}")
+
+    with col2:
+        if st.button("Conversation Flow Export", type="primary"):
+            try:
+                df = create_conversation_flow_csv(db_mtime())
+                csv = _csv_bytes(df)
+                st.download_button(
+                    label="Download Conversation Flow CSV",
+                    data=csv,
+                    file_name=f"conversation_flows_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime="text/csv"
+                )
+                # Parquet is much smaller for long transcripts; only offered if pyarrow/fastparquet is available
+                parquet = _parquet_bytes(df)
+                if parquet is not None:
+                    st.download_button(
+                        label="Download Conversation Flow Parquet",
+                        data=parquet,
+                        file_name=f"conversation_flows_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet",
+                        mime="application/octet-stream"
+                    )
+                st.success(f"Generated conversation flow CSV with {len(df)} participants")
+            except Exception as e:
+                st.error(f"Error creating conversation flow CSV: {e}")
     
-    # Create tabs for different admin functions
-    tab1, tab2 = st.tabs(["Data Export", "System Diagnostics"])
+    with col3:
+        if st.button("Raw Data Tables", type="secondary"):
+            try:
+                admin_data = db_manager.get_admin_data()
+                
+                for table_name, df in admin_data.items():
+                    if not df.empty:
+                        csv = _csv_bytes(df)
+                        st.download_button(
+                            label=f"Download {table_name}.csv",
+                            data=csv,
+                            file_name=f"{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            mime="text/csv",
+                            key=f"download_{table_name}"
+                        )
+                    else:
+                        st.write(f"{table_name}: No data available")
+            
+                st.success("Raw data tables ready for download")
+            except Exception as e:
+                st.error(f"Error creating raw data exports: {e}")
     
-    with tab1:
-        # Export options
-        st.subheader("Download Study Data")
+    # Study Overview
+    st.divider()
+    st.subheader("Study Overview")
+    try:
+        total_participants, completed_questionnaires, total_exchanges = _study_overview(db_mtime())
         
         col1, col2, col3 = st.columns(3)
-        
         with col1:
-            if st.button("Post-Study Questionnaires + Stats", type="primary"):
-                try:
-                    df = create_post_study_stats_csv()
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        label="Download Post-Study Data CSV",
-                        data=csv,
-                        file_name=f"post_study_questionnaires_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv"
-                    )
-                    st.success(f"Generated CSV with {len(df)} completed participants")
-                except Exception as e:
-                    st.error(f"Error creating post-study CSV: {e}")
-    
+            st.metric("Total Registered", total_participants)
         with col2:
-            if st.button("Conversation Flow Export", type="primary"):
-                try:
-                    df = create_conversation_flow_csv()
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        label="Download Conversation Flow CSV",
-                        data=csv,
-                        file_name=f"conversation_flows_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv"
-                    )
-                    st.success(f"Generated conversation flow CSV with {len(df)} participants")
-                except Exception as e:
-                    st.error(f"Error creating conversation flow CSV: {e}")
-        
+            st.metric("Completed Studies", completed_questionnaires)
         with col3:
-            if st.button("Raw Data Tables", type="secondary"):
-                try:
-                    admin_data = db_manager.get_admin_data()
-                    
-                    for table_name, df in admin_data.items():
-                        if not df.empty:
-                            csv = df.to_csv(index=False)
-                            st.download_button(
-                                label=f"Download {table_name}.csv",
-                                data=csv,
-                                file_name=f"{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                mime="text/csv",
-                                key=f"download_{table_name}"
-                            )
-                        else:
-                            st.write(f"{table_name}: No data available")
-                
-                    st.success("Raw data tables ready for download")
-                except Exception as e:
-                    st.error(f"Error creating raw data exports: {e}")
-        
-        # Study Overview
-        st.divider()
-        st.subheader("Study Overview")
-        try:
-            conn = sqlite3.connect(DATABASE_PATH)
-            
-            total_participants = pd.read_sql_query("SELECT COUNT(*) as count FROM participants", conn)['count'][0]
-            completed_questionnaires = pd.read_sql_query("SELECT COUNT(*) as count FROM questionnaire_responses", conn)['count'][0]
-            total_exchanges = pd.read_sql_query("SELECT COUNT(*) as count FROM conversations WHERE user_message IS NOT NULL", conn)['count'][0]
-            
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Total Registered", total_participants)
-            with col2:
-                st.metric("Completed Studies", completed_questionnaires)
-            with col3:
-                st.metric("Total Exchanges", total_exchanges)
-            
-            conn.close()
-        except Exception as e:
-            st.error(f"Error loading overview: {e}")
+            st.metric("Total Exchanges", total_exchanges)
+    except Exception as e:
+        st.error(f"Error loading overview: {e}")
+
+def _render_diagnostics():
+    """Admin RAG diagnostics"""
+    # RAG System Diagnostics
+    st.subheader("RAG System Diagnostics")
+    st.info("This panel helps diagnose RAG system issues in the cloud environment.")
     
-    with tab2:
-        # RAG System Diagnostics
-        st.subheader("RAG System Diagnostics")
-        st.info("This panel helps diagnose RAG system issues in the cloud environment.")
+    if st.button("🧪 Run Diagnostics", type="primary"):
+        test_results = test_rag_system()
         
-        if st.button("🧪 Run Diagnostics", type="primary"):
-            test_results = test_rag_system()
-            
-            # Show recommendations based on results
-            st.subheader("Recommendations")
-            
-            if "❌" in str(test_results.get("RAG Import", "")):
-                st.error("**Critical**: RAG system files not found. Check deployment includes rag_stimulus_pipeline.py")
-            
-            if "❌" in str(test_results.get("ChromaDB", "")):
-                st.error("**Critical**: ChromaDB initialization failed. May need different ChromaDB configuration for cloud.")
-            
-            failed_apis = [name for name, result in test_results.items() if "API" in name and "❌" in result]
-            if failed_apis:
-                st.warning(f"**API Issues**: {', '.join([name.replace(' API', '') for name in failed_apis])} not accessible. Check firewall/network restrictions.")
-            
-            if "❌" in str(test_results.get("RAG System Init", "")):
-                st.error("**Critical**: RAG system cannot initialise. This explains why scenarios are pure AI generation.")
+        # Show recommendations based on results
+        st.subheader("Recommendations")
         
-        st.divider()
-        st.subheader("Manual RAG Test")
+        if "❌" in str(test_results.get("RAG Import", "")):
+            st.error("**Critical**: RAG system files not found. Check deployment includes rag_stimulus_pipeline.py")
         
-        test_query = st.text_input("Test query for RAG system:", value="AI ethics policy")
+        if "❌" in str(test_results.get("ChromaDB", "")):
+            st.error("**Critical**: ChromaDB initialization failed. May need different ChromaDB configuration for cloud.")
         
-        if st.button("Test RAG Query") and test_query:
-            try:
-                from rag_stimulus_pipeline import RAGSystem
-                rag_system = RAGSystem()
-                docs = rag_system.query_rag(test_query)
-                
-                st.success(f"Retrieved {len(docs)} documents")
+        failed_apis = [name for name, result in test_results.items() if "API" in name and "❌" in result]
+        if failed_apis:
+            st.warning(f"**API Issues**: {', '.join([name.replace(' API', '') for name in failed_apis])} not accessible. Check firewall/network restrictions.")
+        
+        if "❌" in str(test_results.get("RAG System Init", "")):
+            st.error("**Critical**: RAG system cannot initialise. This explains why scenarios are pure AI generation.")
+    
+    st.divider()
+    st.subheader("Manual RAG Test")
+    
+    test_query = st.text_input("Test query for RAG system:", value="AI ethics policy")
+    
+    if st.button("Test RAG Query") and test_query:
+        try:
+            from rag_stimulus_pipeline import RAGSystem
+            rag_system = RAGSystem()
+            docs = rag_system.query_rag(test_query)
+            
+            st.success(f"Retrieved {len(docs)} documents")
+            
+            if docs:
+                st.subheader("Retrieved Documents:")
+                for i, doc in enumerate(docs[:3], 1):  # Show first 3
+                    meta = doc.get('metadata', {})
+                    st.write(f"**{i}. [{meta.get('source', 'Unknown')}]** {meta.get('title', 'No title')}")
+                    st.write(f"Content preview: {doc.get('text', '')[:200]}...")
+                    st.divider()
+            else:
+                st.warning("No documents retrieved - RAG system not working properly")
                 
-                if docs:
-                    st.subheader("Retrieved Documents:")
-                    for i, doc in enumerate(docs[:3], 1):  # Show first 3
-                        meta = doc.get('metadata', {})
-                        st.write(f"**{i}. [{meta.get('source', 'Unknown')}]** {meta.get('title', 'No title')}")
-                        st.write(f"Content preview: {doc.get('text', '')[:200]}...")
-                        st.divider()
-                else:
-                    st.warning("No documents retrieved - RAG system not working properly")
-                    
-            except Exception as e:
-                st.error(f"RAG test failed: {e}")
-                st.info("This confirms RAG system is not working in cloud environment")
+        except Exception as e:
+            st.error(f"RAG test failed: {e}")
+            st.info("This confirms RAG system is not working in cloud environment")
+
+def show_admin_panel():
+    """Show admin panel for data export - add ?admin=true to URL"""
+    st.title("🔧 Study Admin Panel")
+    
+    # Only the selected view runs (st.tabs would execute every tab body, including the overview queries)
+    view = st.radio("View", ["Data Export", "System Diagnostics"], horizontal=True, label_visibility="collapsed")
+    
+    if view == "Data Export":
+        _render_data_export()
+    else:
+        _render_diagnostics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file